@@ -1,11 +1,10 @@
 import os
 import pathlib
 import pickle
-import re
 import shutil
-import subprocess
 import tempfile
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Union
 import hashlib
 import json
@@ -13,6 +12,13 @@ from loguru import logger
 import pandas as pd
 import trackhub
 
+from tracknado.utils import (
+    DIMENSION_NAMES,
+    LABEL_SPLIT,
+    sanitize_track_name,
+    set_hub_permissions,
+)
+
 def fix_duplicate_names(df: pd.DataFrame):
     duplicate_counts = defaultdict(int)
 
@@ -33,13 +39,8 @@ def get_hash_for_df(df: pd.DataFrame, columns: Union[List[str], pd.Index] = None
     if columns is None:
         columns = df.columns
     
-    hashes = []
-    for row in df.itertuples():
-        x = tuple([getattr(row, x) for x in columns])
-        hash = get_hash(x)
-        hashes.append(hash)
-    
-    return hashes
+    # Zip over plain column lists rather than looking each value up on a namedtuple
+    return [get_hash(row) for row in zip(*(df[c].tolist() for c in columns))]
 
 class TrackFiles:
     def __init__(
@@ -83,19 +84,22 @@ class TrackFiles:
         else:
             df = pd.Series(files).to_frame("fn")
 
-        paths = [pathlib.Path(fn) for fn in df["fn"].values]
+        # Work on the raw path strings to avoid building Path objects for every file
+        fns = [os.fspath(fn) for fn in df["fn"].values]
+        basenames = [os.path.basename(fn) for fn in fns]
+        names_exts = [os.path.splitext(b) for b in basenames]
 
         if not "path" in df.columns:
-            df["path"] = [str(p.absolute().resolve()) for p in paths]
+            df["path"] = [os.path.realpath(fn) for fn in fns]
         
         if not "basename" in df.columns:
-            df["basename"] = [p.name for p in paths]
+            df["basename"] = basenames
         
         if not "name" in df.columns:
-            df["name"] = [p.stem for p in paths]
+            df["name"] = [name for name, _ in names_exts]
         
         if not "ext" in df.columns:
-            df["ext"] = [p.suffix.strip(".") for p in paths]
+            df["ext"] = [ext.strip(".") for _, ext in names_exts]
 
 
         extension_mapping = {
@@ -115,22 +119,20 @@ class TrackFiles:
         ).tolist()
 
     def fix_duplicate_names(self):
-        duplicate_counts = defaultdict(int)
-
-        for row in self.files.itertuples():
-            duplicate_counts[row.basename] += 1
-            if duplicate_counts[row.basename] > 1:
-                name = f"{row.name}_{duplicate_counts[row.basename]}"
-                basename = f"{row.basename}_{duplicate_counts[row.basename]}.{row.ext}"
-                self.files.loc[row.Index, "name"] = name
-                self.files.loc[row.Index, "basename"] = basename
+        fix_duplicate_names(self.files)
 
     def convert_tracks_to_ucsc_format(
         self, chrom_sizes: Union[str, pathlib.Path], outdir: Union[str, pathlib.Path]
     ) -> None:
         """Convert tracks to UCSC format"""
 
-        from tracknado.utils import has_valid_chromsizes, has_tracks_to_convert
+        from tracknado.utils import (
+            SORT_BUFFER_BUDGET_MB,
+            convert_bed_to_bigbed,
+            get_tool_path,
+            has_tracks_to_convert,
+            has_valid_chromsizes,
+        )
 
         if has_tracks_to_convert(self.files):
 
@@ -142,42 +144,56 @@ class TrackFiles:
             outdir = pathlib.Path(outdir)
             outdir.mkdir(exist_ok=True)
 
+            # Fail fast if the tools are missing. The lookups are cached so the workers reuse them
+            get_tool_path("sort")
+            get_tool_path("bedToBigBed")
+
             # convert bed to bigBed
             bed_files = self.files[self.files["ext"] == "bed"]
+            conversions = []
+            bigbed_basenames = set()
             for bed_file in bed_files.itertuples():
 
-                print(f"Converting {bed_file.name} to BigBed format")
-
                 bed_file_path = pathlib.Path(bed_file.path).absolute()
                 bed_file_basename = bed_file_path.name.removesuffix(".bed")
 
+                # BED files from different directories can share a name so suffix repeats to keep each output distinct
+                stem, n = bed_file_basename, 1
+                while bed_file_basename in bigbed_basenames:
+                    n += 1
+                    bed_file_basename = f"{stem}_{n}"
+                bigbed_basenames.add(bed_file_basename)
 
-                cmd_sort = [
-                    "sort",
-                    "-k1,1",
-                    "-k2,2n",
-                    str(bed_file_path),
-                    "-o",
-                    bed_file_path.with_suffix(".sorted.bed"),
-                ]
-
-                cmd_convert = [
-                    "bedToBigBed",
-                    str(bed_file_path.with_suffix(".sorted.bed")),
-                    str(chrom_sizes),
-                    f"{outdir.joinpath(bed_file_basename)}.bigBed",
-                ]
-
-                subprocess.run(cmd_sort, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                subprocess.run(cmd_convert, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-                # Remove the sorted bed file
-                bed_file_path.with_suffix(".sorted.bed").unlink()
+                bigbed_path = outdir.joinpath(f"{bed_file_basename}.bigBed")
+                conversions.append((bed_file_path, bigbed_path))
 
                 # Update the file name in the dataframe
-                self.files.loc[bed_file.Index, "path"] = outdir.joinpath(bed_file_basename).with_suffix(".bigBed")
+                self.files.loc[bed_file.Index, "path"] = str(bigbed_path)
                 self.files.loc[bed_file.Index, "ext"] =  "bigBed"
-                self.files.loc[bed_file.Index, "fn"] = self.files.loc[bed_file.Index, "path"]        
+                self.files.loc[bed_file.Index, "fn"] = self.files.loc[bed_file.Index, "path"]
+
+            logger.info(f"Converting {len(conversions)} BED file(s) to BigBed format")
+
+            # Each conversion is an independent set of subprocesses so run them concurrently,
+            # splitting the cores and sort buffer memory between the workers.
+            # Sorted intermediates go in a private temp directory that is removed even if a conversion fails
+            n_cpus = os.cpu_count() or 1
+            n_workers = min(len(conversions), n_cpus)
+            sort_kwargs = dict(
+                sort_threads=max(1, n_cpus // n_workers),
+                sort_buffer_size=f"{max(64, SORT_BUFFER_BUDGET_MB // n_workers)}M",
+            )
+
+            with tempfile.TemporaryDirectory(prefix="tracknado_") as tmpdir:
+                with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                    futures = [
+                        executor.submit(convert_bed_to_bigbed, bed, chrom_sizes, bigbed, tmpdir, **sort_kwargs)
+                        for bed, bigbed in conversions
+                    ]
+
+                    # Propagate any conversion errors
+                    for future in futures:
+                        future.result()
 
 
     def infer_attributes_from_file_names(
@@ -437,7 +453,7 @@ class TrackDesign:
         composite_tracks = dict()
         dimensions = dict(
                     zip(
-                        [f"dim{d}" for d in ["X", "Y", "A", "B", "C", "D"]],
+                        DIMENSION_NAMES,
                         self._subgroup_columns,
                     )
                 )
@@ -737,10 +753,12 @@ class HubGenerator:
                 }
             )
         
+        label = " ".join(LABEL_SPLIT.split(track.name))
+
         return  trackhub.Track(
-                name="".join([trackhub.helpers.sanitize(track.name), suffix]),
-                shortLabel=" ".join(re.split(r"[.|_|\s+|-]", track.name)),
-                longLabel=" ".join(re.split(r"[.|_|\s+|-]", track.name)),
+                name="".join([sanitize_track_name(track.name), suffix]),
+                shortLabel=label,
+                longLabel=label,
                 source=str(track.path),
                 tracktype=track.ext,
                 **extra_kwargs,
@@ -791,7 +809,8 @@ class HubGenerator:
                     os.path.join(tmpdir, self.genome_name),
                 )
 
-            # Copy to the new location
+            # Copy to the new location. trackhub stages the data as symlinks to the source files,
+            # so copy with symlinks=False rather than renaming to publish real files
             shutil.copytree(
                 tmpdir,
                 self.outdir,
@@ -799,7 +818,7 @@ class HubGenerator:
                 symlinks=False,
             )
 
-            subprocess.run(["chmod", "-R", "2755", self.outdir])
+        set_hub_permissions(self.outdir)
         
     
     def to_pickle(self, path: str) -> None:
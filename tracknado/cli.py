@@ -70,7 +70,8 @@ def design(input_files: list, output: str, preset: Union[None, Literal["seqnado"
     tf = TrackFiles(input_files, infer_subgroups=True, infer_attributes=True)
 
     if preset == "seqnado":
-        tf.files = tf.files.assign(experiment=lambda df: df["fn"].apply(lambda x: x.parent.parent.parent.name))
+        # Experiment is the great-grandparent directory of each file e.g. EXPERIMENT/bigwigs/METHOD/FILE
+        tf.files = tf.files.assign(experiment=lambda df: df["path"].str.split(os.sep).str[-4])
 
     tf.files.to_csv(output)
 
@@ -211,8 +212,8 @@ def create(*args, **kwargs):
 
     # sys.tracebacklimit = 0
     logger.info("Initialising tracknado")
-    import pandas as pd
     from tracknado.api import TrackDesign, HubGenerator
+    from tracknado.utils import read_design
 
     # Fix cli to api differences
     kwargs["color_by"] = kwargs["color_by"][0] if kwargs["color_by"] else None
@@ -235,7 +236,7 @@ def create(*args, **kwargs):
         )
 
     else:
-        details = pd.read_csv(kwargs["details"], sep=r"\s+|\t|,", engine="python")
+        details = read_design(kwargs["details"])
         kwargs.pop("input_files")
         kwargs.pop("details")
 
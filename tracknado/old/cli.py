@@ -1,3 +1,4 @@
+import re
 import click
 from .make_hub import get_file_attributes, make_hub
 import pandas as pd
@@ -11,25 +12,19 @@ def categorise_capcruncher_tracks(df_file_attributes: pd.DataFrame):
         "subtraction": "SamplesCompared",
     }
 
-    return [
-        mapping[k]
-        for _, method in df_file_attributes["method"].iteritems()
-        for k in mapping
-        if k in method
-    ]
+    pattern = "|".join(re.escape(k) for k in mapping)
+    return (
+        df_file_attributes["method"]
+        .str.extract(f"({pattern})", expand=False)
+        .map(mapping)
+    )
 
 
 def get_ngs_pipeline_attributes(df_file_attributes: pd.DataFrame):
 
-    chipseq_pattern = r"(?P<samplename>.*?)_(?P<antibody>.*)_(?:.*).(bigWig|bed|bigBed)"
-    generic_pattern = r"(?P<samplename>.*?).(bigWig|bed|bigBed)"
-    attributes = df_file_attributes["basename"].str.extract(chipseq_pattern)
-
-    if attributes["samplename"].dropna().shape[0]:
-        attributes = df_file_attributes["basename"].str.extract(
-            generic_pattern)
-
-    return attributes
+    # SAMPLENAME_ANTIBODY_*.ext for ChIP-seq files, otherwise SAMPLENAME.ext (antibody is NaN)
+    pattern = r"(?P<samplename>.*?)(?:_(?P<antibody>.*)_.*?)?\.(?:bigWig|bed|bigBed)$"
+    return df_file_attributes["basename"].str.extract(pattern)
 
 
 @click.command()
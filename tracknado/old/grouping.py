@@ -1,10 +1,9 @@
 import trackhub
 import pandas as pd
 from typing import Dict, Tuple
-import re
-import pathlib
 
-from .track import get_track_subgroups
+from ..utils import DIMENSION_NAMES, LABEL_SPLIT, sanitize_track_name
+
 
 def get_subgroup_definitions(
     df_file_attributes: pd.DataFrame, grouping_columns: str = None
@@ -15,9 +14,9 @@ def get_subgroup_definitions(
     if grouping_columns:
         columns_to_drop.append(grouping_columns)
 
+    columns = [col for col in df_file_attributes.columns if col not in columns_to_drop]
     group_members = {
-        col: df_file_attributes[col].unique()
-        for col in df_file_attributes.drop(columns=columns_to_drop, errors="ignore")
+        col: pd.unique(df_file_attributes[col].to_numpy()) for col in columns
     }
 
     subgroups = {
@@ -32,44 +31,70 @@ def get_subgroup_definitions(
     return subgroups
 
 
-def add_hub_group(container: trackhub.Track, hub: trackhub.Hub = None, custom_genome: bool = False):
+def get_color_strings(
+    color_mapping: Dict[str, Tuple[float, float, float]]
+) -> Dict[str, str]:
+    """Format each colour in the mapping as a UCSC "R,G,B" string"""
+    return {
+        key: ",".join(str(int(x * 255)) for x in rgb)
+        for key, rgb in color_mapping.items()
+    }
+
+
+def get_hub_group_kwargs(hub: trackhub.Hub = None, custom_genome: bool = False) -> Dict[str, str]:
+    """Track keyword arguments that place a track in the hub group for custom genomes"""
     if custom_genome:
         if hub:
-            container.add_params(group=hub.hub)
+            return {"group": hub.hub}
         else:
             raise ValueError("Custom genome specified but no hub provided")
 
+    return {}
+
+
+def add_hub_group(container: trackhub.Track, hub: trackhub.Hub = None, custom_genome: bool = False):
+    container.add_params(**get_hub_group_kwargs(hub=hub, custom_genome=custom_genome))
+
 
 def add_composite_tracks_to_container(
     container: trackhub.TrackDb,
     track_details: pd.DataFrame,
     subgroup_definitions: Dict[str, trackhub.SubGroupDefinition],
     color_by: list,
-    color_mapping: Dict[str, Tuple[float, float, float]],
+    color_strings: Dict[str, str],
     track_suffix: str = "",
     custom_genome: bool = False,
     genome_twobit: str = "",  
     hub: trackhub.Hub = None,
 ):
 
-    dimensions = dict(
-        zip([f"dim{d}" for d in ["X", "Y", "A", "B", "C", "D"]], subgroup_definitions)
-    )
+    dimensions = dict(zip(DIMENSION_NAMES, subgroup_definitions))
 
-    for track_type, df in track_details.groupby("ext"):
+    # These only depend on the subgroups so build them once for every file type
+    dimensions_str = " ".join([f"{k}={v}" for k, v in dimensions.items()]) if dimensions else None
+    sort_order_str = " ".join([f"{k}=+" for k in subgroup_definitions]) if subgroup_definitions else None
 
-        track_types = {
-            "bigwig": "Signal_Pileup",
-            "bigbed": "Peaks_or_Regions_of_Interest",
-        }
+    track_types = {
+        "bigwig": "Signal_Pileup",
+        "bigbed": "Peaks_or_Regions_of_Interest",
+    }
+
+    # The group is the same for every track so work it out once
+    group_kwargs = get_hub_group_kwargs(hub=hub, custom_genome=custom_genome)
 
+    # Only a handful of extensions are ever present so partition with a mask rather than a groupby
+    exts = track_details["ext"].to_numpy()
+    unique_exts = pd.unique(exts)
+    for track_type in unique_exts:
+        # Hubs commonly hold a single file type, in which case there is nothing to partition
+        df = track_details if len(unique_exts) == 1 else track_details.loc[exts == track_type]
 
         # Make composite for each file type
         composite = trackhub.CompositeTrack(
             name=f"{track_types.get(str(track_type.lower()), 'Tracks')}",
             short_label=f"{track_type}",
-            dimensions=" ".join([f"{k}={v}" for k, v in dimensions.items()]) if dimensions else None,
-            sortOrder=" ".join([f"{k}=+" for k in subgroup_definitions]) if subgroup_definitions else None,
+            dimensions=dimensions_str,
+            sortOrder=sort_order_str,
             tracktype=track_type,
             visibility="hide",
             dragAndDrop="subTracks",
@@ -85,41 +110,41 @@ def add_composite_tracks_to_container(
             [definition for definition in subgroup_definitions.values()]
         )
 
-        # Add tracks to composite
-        for track_file in df.itertuples():
-            
+        # Pull out the columns once rather than looking up attributes on every row
+        names = df["name"].to_numpy()
+        paths = df["path"].to_numpy()
+        subgroup_values = {
+            subgroup: df[subgroup].astype(str).str.lower().to_numpy()
+            for subgroup in subgroup_definitions
+        }
+        color_keys = df[color_by].astype(str).agg("".join, axis=1).to_numpy()
 
-            path = pathlib.Path(track_file.path)
-            track_name_base = trackhub.helpers.sanitize(track_file.name)
-            track_groupings = get_track_subgroups(track_file, subgroup_definitions)
+        # Build all of the tracks first and then add them to the composite in one call
+        tracks = []
+        for i in range(len(df)):
+
+            track_name_base = sanitize_track_name(names[i])
+            label = " ".join(LABEL_SPLIT.split(names[i]))
 
             track = trackhub.Track(
                 name=f"{track_name_base}_{track_type}{'_' + track_suffix if track_suffix else ''}",
-                shortLabel=" ".join(re.split(r"[.|_|\s+|-]", track_file.name)),
-                longLabel=" ".join(re.split(r"[.|_|\s+|-]", track_file.name)),
-                source=track_file.path,
+                shortLabel=label,
+                longLabel=label,
+                source=paths[i],
                 autoScale="on",
                 tracktype=track_type,
                 windowingFunction="mean",
                 subgroups={
-                    subgroup: str(getattr(track_file, subgroup)).lower()
-                    for subgroup in subgroup_definitions
+                    subgroup: values[i]
+                    for subgroup, values in subgroup_values.items()
                 },
-                color=",".join(
-                    [
-                        str(int(x * 255))
-                        for x in color_mapping[
-                            "".join(getattr(track_file, cb) for cb in color_by)
-                        ]
-                    ]
-                ),
+                color=color_strings[color_keys[i]],
+                **group_kwargs,
             )
 
-            # Add group to track if custom genome
-            add_hub_group(container=track, hub=hub, custom_genome=custom_genome)
+            tracks.append(track)
 
-            # Append track to composite
-            composite.add_subtrack(track)
+        composite.add_tracks(tracks)
 
         # Add to trackdb
         container.add_tracks(composite)
@@ -130,7 +155,7 @@ def add_overlay_track_to_container(
     container: trackhub.TrackDb,
     track_details: pd.DataFrame,
     color_by: list,
-    color_mapping: Dict[str, Tuple[float, float, float]],
+    color_strings: Dict[str, str],
     custom_genome: bool = False,
     hub: trackhub.Hub = None,
 ):
@@ -146,37 +171,35 @@ def add_overlay_track_to_container(
 
     # Need to add group if custom genome
     add_hub_group(container=overlay, hub=hub, custom_genome=custom_genome)
+    group_kwargs = get_hub_group_kwargs(hub=hub, custom_genome=custom_genome)
+
+    names = track_details["name"].to_numpy()
+    paths = track_details["path"].to_numpy()
+    color_keys = track_details[color_by].astype(str).agg("".join, axis=1).to_numpy()
 
-    for track_file in track_details.itertuples():
+    tracks = []
+    for i in range(len(track_details)):
 
-        track_name_base = trackhub.helpers.sanitize(track_file.name)
+        track_name_base = sanitize_track_name(names[i])
+        label = " ".join(LABEL_SPLIT.split(names[i]))
 
         track = trackhub.Track(
             name=f"{track_name_base}_{track_name}_overlay",
-            shortLabel=" ".join(re.split(r"[.|_|\s+|-]", track_file.name)),
-            longLabel=" ".join(re.split(r"[.|_|\s+|-]", track_file.name)),
-            source=track_file.path,
+            shortLabel=label,
+            longLabel=label,
+            source=paths[i],
             autoScale="on",
             tracktype="bigWig",
             windowingFunction="mean",
-            color=",".join(
-                [
-                    str(int(x * 255))
-                    for x in color_mapping[
-                        "".join(getattr(track_file, cb) for cb in color_by)
-                    ]
-                ]
-            ),
+            color=color_strings[color_keys[i]],
+            **group_kwargs,
         )
+        tracks.append(track)
 
-        # Add group to track if custom genome
-        add_hub_group(container=track, hub=hub, custom_genome=custom_genome)
+    overlay.add_tracks(tracks)
 
-        # Append track to composite
-        overlay.add_subtrack(track)
-
-        # Add to trackdb
-        container.add_tracks(overlay)
+    # Add to trackdb
+    container.add_tracks(overlay)
 
 
 
@@ -185,28 +208,27 @@ def add_generic_tracks(
     parent: trackhub.BaseTrack,
     track_details: pd.DataFrame,
     color_by: list,
-    color_mapping: Dict[str, Tuple[float, float, float]],
+    color_strings: Dict[str, str],
     custom_genome: bool = False,
     hub: trackhub.Hub = None,
 ):
 
-    for track_file in track_details.itertuples():
+    samplenames = track_details["samplename"].to_numpy()
+    paths = track_details["path"].to_numpy()
+    exts = track_details["ext"].to_numpy()
+    color_keys = track_details[color_by].astype(str).agg("".join, axis=1).to_numpy()
+    group_kwargs = get_hub_group_kwargs(hub=hub, custom_genome=custom_genome)
+
+    for i in range(len(track_details)):
 
         track = trackhub.Track(
-            name=track_file.samplename,
-            source=track_file.path,
-            tracktype=track_file.ext.strip("."),
+            name=samplenames[i],
+            source=paths[i],
+            tracktype=exts[i],
             autoScale="on",
-            color=",".join(
-                [
-                    str(int(x * 255))
-                    for x in color_mapping[
-                        "".join(getattr(track_file, cb) for cb in color_by)
-                    ]
-                ]
-            ),
+            color=color_strings[color_keys[i]],
+            **group_kwargs,
         )
 
-        add_hub_group(container=track, hub=hub, custom_genome=custom_genome)
         parent.add_tracks(track)
 
@@ -1,3 +1,5 @@
+import functools
+import numpy as np
 import trackhub
 import pandas as pd
 from typing import Dict, Tuple
@@ -39,12 +41,9 @@ def make_track_palette(
     if len(color_by) == 1:
         unique_samples = df_file_attributes[color_by[0]].unique()
     else:
-        unique_samples = (
-            df_file_attributes[color_by]
-            .drop_duplicates()
-            .astype(str)
-            .apply("".join, axis=1)
-        )
+        # Concatenate the colour-by columns element-wise as NumPy strings
+        columns = [df_file_attributes[c].to_numpy(dtype=str) for c in color_by]
+        unique_samples = pd.unique(functools.reduce(np.char.add, columns))
     colors = sns.color_palette(palette=palette, n_colors=len(unique_samples))
     color_mapping = dict(zip(unique_samples, colors))
     return color_mapping
\ No newline at end of file
@@ -9,8 +9,8 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 import trackhub
-import subprocess
 
+from ..utils import read_design, set_hub_permissions
 from .track import get_file_attributes, get_groups_from_design_matrix
 from .hub_setup import get_genome_file, make_track_palette
 from .grouping import (
@@ -18,6 +18,7 @@ from .grouping import (
     add_composite_tracks_to_container,
     add_overlay_track_to_container,
     add_hub_group,
+    get_color_strings,
 )
 
 
@@ -42,7 +43,7 @@ def stage_hub(
                 os.path.join(tmpdir, genome.genome),
             )
 
-        # Copy to the new location
+        # Copy to the new location, replacing the staged symlinks with real files
         shutil.copytree(
             tmpdir,
             outdir,
@@ -50,9 +51,18 @@ def stage_hub(
             symlinks=False,
         )
 
-        subprocess.run(["chmod", "-R", "2755", outdir])
+    set_hub_permissions(outdir)
     
 
+def read_design_matrix(details: str) -> pd.DataFrame:
+    """Read a design matrix indexed by filename"""
+
+    df = read_design(details).set_index("filename")
+
+    # Design columns repeat a few values (samples, antibodies etc) across many files so store them as categoricals
+    return df.astype({col: "category" for col in df.select_dtypes("object").columns})
+
+
 def get_grouping_columns(cols):
     try:
         if len(cols) > 1:
@@ -85,9 +95,7 @@ def make_hub(
 
     # Design matrix in the format: filename samplename ATTRIBUTE_1 ATTRIBUTE_2 ...
     if isinstance(details, str):
-        df_details = pd.read_csv(
-            details, sep=r"\s+|\t|,", engine="python", index_col="filename"
-        )
+        df_details = read_design_matrix(details)
     elif isinstance(details, pd.DataFrame):
         df_details = details
     else:
@@ -99,6 +107,17 @@ def make_hub(
             df_file_attributes=df_file_attributes, df_design=df_details
         )
 
+    # Few distinct values are shared by many files so group on categorical codes rather than strings
+    grouping_columns = [
+        col
+        for cols in (group_composite, group_overlay)
+        if cols is not None
+        for col in ([cols] if isinstance(cols, str) else cols)
+    ]
+    for col in {"ext", "samplename", *grouping_columns}:
+        if col in df_file_attributes.columns:
+            df_file_attributes[col] = df_file_attributes[col].astype("category")
+
     # Create hub
     hub = trackhub.Hub(
         hub=kwargs["hub_name"],
@@ -135,12 +154,15 @@ def make_hub(
         color_by=color_tracks_by,
     )
 
+    # Format each colour once here rather than for every group of tracks
+    color_strings = get_color_strings(color_mapping)
+
     # Make supertracks to hold any groupings
     supertracks = dict()
 
     # Composite tracks
     if group_composite:
-        for group_name, df in df_file_attributes.groupby(group_composite):
+        for group_name, df in df_file_attributes.groupby(group_composite, observed=True):
             supertracks[group_name] = trackhub.SuperTrack(name=group_name)
 
             add_composite_tracks_to_container(
@@ -148,7 +170,7 @@ def make_hub(
                 track_details=df,
                 subgroup_definitions=subgroup_definitions,
                 color_by=color_tracks_by,
-                color_mapping=color_mapping,
+                color_strings=color_strings,
                 track_suffix=group_name,
                 custom_genome=custom_genome,
                 hub=hub,
@@ -163,14 +185,14 @@ def make_hub(
             track_details=df_file_attributes,
             subgroup_definitions=subgroup_definitions,
             color_by=color_tracks_by,
-            color_mapping=color_mapping,
+            color_strings=color_strings,
             custom_genome=custom_genome,
             hub=hub,
             genome_twobit=kwargs["genome_twobit"],
         )
 
     if group_overlay:
-        for group_name, df in df_file_attributes.groupby(group_overlay):
+        for group_name, df in df_file_attributes.groupby(group_overlay, observed=True):
 
             supertrack_exists = False
             if not group_name in supertracks:
@@ -182,7 +204,7 @@ def make_hub(
                 container=supertracks[group_name],
                 track_details=df,
                 color_by=color_tracks_by,
-                color_mapping=color_mapping,
+                color_strings=color_strings,
                 custom_genome=custom_genome,
                 hub=hub,
             )
@@ -197,15 +219,16 @@ def make_hub(
     trackdb.add_tracks(supertracks.values())
 
     ## Add generic tracks
-    for track in kwargs["generic_tracks"]:
-        track_name = trackhub.helpers.sanitize(os.path.basename(t))
-        track_path = os.path.abspath(track)
-        t = trackhub.Track(
-            name=track_name,
-            source=track_path,
-            tracktype=os.path.basename(track_name).split(".")[1],
+    # Only a handful are expected so work on the paths directly rather than building a frame of file attributes
+    for track_path in kwargs.get("generic_tracks", ()):
+        basename = os.path.basename(track_path)
+        track = trackhub.Track(
+            name=trackhub.helpers.sanitize(basename),
+            source=os.path.abspath(track_path),
+            tracktype=os.path.splitext(basename)[1].strip("."),
         )
 
+        add_hub_group(container=track, hub=hub, custom_genome=custom_genome)
         trackdb.add_tracks(track)
 
     # Copy hub to the correct directory
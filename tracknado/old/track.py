@@ -1,23 +1,45 @@
+import os
 import pandas as pd
-import pathlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 import seaborn as sns
-import trackhub
-from typing import Dict
+from typing import Dict, Union
+import shlex
 import subprocess
+import tempfile
 import numpy as np
-from collections import defaultdict
 
+from ..utils import SORT_BUFFER_BUDGET_MB
 
-def convert_to_bigbed(bed: str, chrom_sizes: str, out: str):
 
-    cmd = f"""
-            export LC_ALL=C &&
-            sort -k1,1 -k2,2n {bed} | cut -f 1-3 | grep -P 'chr(\d+|X|Y)' > {bed}.tmp && 
-            bedToBigBed {bed}.tmp {chrom_sizes} {out}
-            rm {bed}.tmp
-           """
-    subprocess.run(cmd, shell=True)
+def convert_to_bigbed(
+    bed: str,
+    chrom_sizes: str,
+    out: str,
+    sort_threads: int = None,
+    sort_buffer_size: str = None,
+):
+
+    # bedToBigBed reads its input twice so it needs a real file rather than a pipe.
+    # Keep the filtered intermediate in a temporary directory (TMPDIR can point at tmpfs) instead of next to the input
+    with tempfile.TemporaryDirectory(prefix="tracknado_") as tmpdir:
+        filtered_bed = os.path.join(tmpdir, "filtered.bed")
+
+        # pipefail reports a failure from any stage, grep exiting 1 only means no rows matched which is not an error
+        sort_options = ""
+        if sort_threads:
+            sort_options += f" --parallel={sort_threads}"
+        if sort_buffer_size:
+            sort_options += f" -S {sort_buffer_size}"
+
+        cmd = (
+            f"sort{sort_options} -k1,1 -k2,2n {shlex.quote(bed)} | cut -f 1-3 "
+            f"| {{ grep -E '^chr([0-9]+|X|Y)[[:space:]]' || [ $? -eq 1 ]; }} > {shlex.quote(filtered_bed)}"
+        )
+        subprocess.run(["bash", "-o", "pipefail", "-c", cmd], check=True, env={**os.environ, "LC_ALL": "C"})
+        subprocess.run(["bedToBigBed", filtered_bed, chrom_sizes, out], check=True)
+
     return out
 
 
@@ -25,56 +47,83 @@ def convert_to_bigbed(bed: str, chrom_sizes: str, out: str):
 def get_file_attributes(files: Tuple, convert: bool = False, chrom_sizes: str = ""):
 
     if convert:
-        files_new = []
-        for fn in files:
+
+        # Each conversion is an independent shell pipeline so run them concurrently,
+        # splitting the cores and sort buffer memory between the workers
+        n_cpus = os.cpu_count() or 1
+        n_workers = max(1, min(sum(fn.endswith(".bed") for fn in files), n_cpus))
+        sort_threads = max(1, n_cpus // n_workers)
+        sort_buffer_size = f"{max(64, SORT_BUFFER_BUDGET_MB // n_workers)}M"
+
+        def _convert(fn: str) -> str:
             if fn.endswith(".bed"):
-                files_new.append(convert_to_bigbed(fn, chrom_sizes, fn.replace(".bed", ".bigBed")))
-            else:
-                files_new.append(fn)
-        files = tuple(files_new)
+                return convert_to_bigbed(
+                    fn,
+                    chrom_sizes,
+                    fn.replace(".bed", ".bigBed"),
+                    sort_threads=sort_threads,
+                    sort_buffer_size=sort_buffer_size,
+                )
+            return fn
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            files = tuple(executor.map(_convert, files))
     
-    df = pd.Series(files).to_frame("fn")
-    paths = [pathlib.Path(fn) for fn in df["fn"].values]
-    df["path"] = [str(p.absolute().resolve()) for p in paths]
-    df["basename"] = [p.name for p in paths]
-    df["name"] = [p.stem for p in paths]
-    df["ext"] = [p.suffix.strip(".") for p in paths]
-
-    # Deal with duplicate names
-    basenames = defaultdict(int)
-    for row in df.itertuples():
-        basenames[row.basename] += 1
-        if basenames[row.basename] > 1:
+    # Tracks usually share a handful of directories so resolve each directory once rather than every file
+    resolved_dirs: Dict[str, str] = {}
+
+    def _resolve(fn: str) -> str:
+        if os.path.islink(fn):
+            return os.path.realpath(fn)
+
+        dirname, basename = os.path.split(fn)
+        if dirname not in resolved_dirs:
+            resolved_dirs[dirname] = os.path.realpath(dirname or os.curdir)
+        return os.path.join(resolved_dirs[dirname], basename)
+
+    fns, resolved, basenames, names, exts = [], [], [], [], []
+    for fn in files:
+        fn = os.fspath(fn)
+        basename = os.path.basename(fn)
+        name, ext = os.path.splitext(basename)
+
+        fns.append(fn)
+        resolved.append(_resolve(fn))
+        basenames.append(basename)
+        names.append(name)
+        exts.append(ext.strip("."))
+
+    df = pd.DataFrame(
+        {"fn": fns, "path": resolved, "basename": basenames, "name": names, "ext": exts}
+    )
 
-            name = f"{row.name}_{basenames[row.basename]}"
-            basename = f"{row.basename}_{basenames[row.basename]}.{row.ext}"
-            df.loc[row.Index, "name"] = name
-            df.loc[row.Index, "basename"] = basename
+    # Deal with duplicate names by suffixing repeat occurrences with their count e.g. sample_2
+    occurrence = df.groupby("basename").cumcount() + 1
+    duplicated = occurrence > 1
+    df.loc[duplicated, "name"] = (
+        df.loc[duplicated, "name"] + "_" + occurrence[duplicated].astype(str)
+    )
+    df.loc[duplicated, "basename"] = (
+        df.loc[duplicated, "name"] + "." + df.loc[duplicated, "ext"]
+    )
 
 
     return df
 
 
-def get_groups_from_regex(df_file_attributes: pd.DataFrame, pattern: str):
+def get_groups_from_regex(
+    df_file_attributes: pd.DataFrame, pattern: Union[str, re.Pattern]
+):
 
-    groups = df_file_attributes["basename"].str.extract(pattern).reset_index()
-    return pd.concat([df_file_attributes, groups], axis=1)
+    # extract keeps the index of the input so the groups can be joined on directly.
+    # Groups named after an existing column replace it
+    groups = df_file_attributes["basename"].str.extract(re.compile(pattern))
+    return df_file_attributes.drop(columns=groups.columns, errors="ignore").join(groups)
 
 
 def get_groups_from_design_matrix(
     df_file_attributes: pd.DataFrame, df_design: pd.DataFrame
 ):
-    return (
-        df_file_attributes.set_index("fn")
-        .join(df_design)
-        .reset_index()
-        .rename(columns={"index": "fn"})
+    return df_file_attributes.merge(
+        df_design, how="left", left_on="fn", right_index=True
     )
-
-def get_track_subgroups(
-    track_details: tuple,
-    subgroup_definitions: Dict[str, trackhub.SubGroupDefinition],
-):
-    return "_".join(
-        [str(getattr(track_details, subgroup)).lower() for subgroup in subgroup_definitions]
-    )
\ No newline at end of file
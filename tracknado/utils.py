@@ -1,7 +1,45 @@
+import csv
+import functools
+import io
+import json
+import os
 import pathlib
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
 from typing import Union
 import click
 import pandas as pd
+import trackhub
+from loguru import logger
+
+
+# Characters used to split track names into human-readable labels
+LABEL_SPLIT = re.compile(r"[._\s|-]+")
+
+# UCSC composite track dimension names in the order subgroups are assigned to them
+DIMENSION_NAMES = [f"dim{d}" for d in ["X", "Y", "A", "B", "C", "D"]]
+
+# Track names recur across composite and overlay groupings so cache the sanitised form
+sanitize_track_name = functools.lru_cache(maxsize=None)(trackhub.helpers.sanitize)
+
+# BED files larger than this are always sorted with GNU sort rather than in memory
+IN_MEMORY_SORT_MAX_BYTES = 512 * 1024**2
+
+# Peak memory of an in-memory sort as a multiple of the BED file size (measured at ~4.5x)
+IN_MEMORY_SORT_MEMORY_FACTOR = 5
+
+# Buffer size used when streaming BED files to and from disk
+IO_BUFFER_SIZE = 1024**2
+
+# Total GNU sort buffer memory (MB) shared between conversions running at the same time
+SORT_BUFFER_BUDGET_MB = 1024
+
+# Each in-memory sort peaks at IN_MEMORY_SORT_MEMORY_FACTOR times the file size so only allow a few at once
+MAX_CONCURRENT_IN_MEMORY_SORTS = 2
+_in_memory_sort_slots = threading.BoundedSemaphore(MAX_CONCURRENT_IN_MEMORY_SORTS)
 
 
 def has_valid_chromsizes(chrom_sizes: Union[str, pathlib.Path]) -> bool:
@@ -24,3 +62,229 @@ def has_tracks_to_convert(df: pd.DataFrame) -> bool:
         return False
 
     return True
+
+
+def read_design(design: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """Read a design file, detecting the delimiter from the header so the C parser can be used"""
+
+    with open(design) as f:
+        header = f.readline()
+
+    if "\t" in header:
+        sep = "\t"
+    elif "," in header:
+        sep = ","
+    else:
+        sep = r"\s+"
+
+    return pd.read_csv(design, sep=sep, engine="c", skipinitialspace=True)
+
+
+def set_hub_permissions(outdir: Union[str, pathlib.Path], mode: int = 0o2755) -> None:
+    """Recursively set the permissions of a staged hub, equivalent to chmod -R 2755.
+
+    Like chmod -R, symlinks found while recursing are left alone so their targets (e.g. source
+    data) are not modified. Files that cannot be changed, such as those owned by another user in a
+    shared hub directory, are logged rather than raised.
+    """
+
+    for root, _, files in os.walk(outdir):
+        for path in [root, *(os.path.join(root, fn) for fn in files)]:
+            if path != root and os.path.islink(path):
+                continue
+
+            try:
+                os.chmod(path, mode)
+            except PermissionError:
+                logger.warning("Unable to set permissions of {}", path)
+
+
+def get_in_memory_sort_max_bytes() -> int:
+    """Largest BED file (in bytes) that can be sorted in memory with the memory currently available.
+
+    Assumes every in-memory sort slot is in use. Returns 0, i.e. always use GNU sort, if the
+    available memory cannot be determined.
+    """
+
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+    per_sort = available // (IN_MEMORY_SORT_MEMORY_FACTOR * MAX_CONCURRENT_IN_MEMORY_SORTS)
+    return min(IN_MEMORY_SORT_MAX_BYTES, per_sort)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tool_path(tool: str) -> str:
+    """Locate an executable on the PATH. Results are cached for the life of the process"""
+
+    path = shutil.which(tool)
+    if path is None:
+        raise FileNotFoundError(f"{tool} not found. Please ensure it is installed and on the PATH")
+
+    return path
+
+
+def sort_bed_in_memory(
+    bed: Union[str, pathlib.Path], outfile: Union[str, pathlib.Path]
+) -> bool:
+    """Sort a BED file by chromosome then numeric start position in memory.
+
+    Only the chromosome and start columns are parsed (start as int64) to determine the order,
+    the original lines are then written out unchanged. Returns False without writing anything if
+    the file cannot be parsed as plain BED (e.g. it has header or track lines) so that the caller
+    can fall back to GNU sort.
+    """
+
+    # Read the file once, hinting to the kernel that it will be read front to back
+    with open(bed, "rb") as r:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(r.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        data = r.read()
+
+    try:
+        keys = pd.read_csv(
+            io.BytesIO(data),
+            sep="\t",
+            header=None,
+            usecols=[0, 1],
+            dtype={0: str, 1: "int64"},
+            quoting=csv.QUOTE_NONE,
+            skip_blank_lines=False,
+            # Compare chromosome names as raw strings, "NA" and "null" are valid names not missing values
+            na_filter=False,
+        )
+    except (ValueError, pd.errors.ParserError):
+        return False
+
+    lines = data.splitlines(keepends=True)
+
+    if len(lines) != len(keys):
+        return False
+
+    # Lines are reordered so the last one must be newline terminated
+    if not lines[-1].endswith(b"\n"):
+        lines[-1] += b"\n"
+
+    order = keys.sort_values([0, 1]).index.to_numpy()
+
+    with open(outfile, "wb", buffering=IO_BUFFER_SIZE) as w:
+        w.writelines(lines[i] for i in order)
+
+    return True
+
+
+def get_conversion_source(
+    bed: Union[str, pathlib.Path], chrom_sizes: Union[str, pathlib.Path]
+) -> dict:
+    """Identify the inputs of a bigBed conversion by resolved path, size and mtime"""
+
+    source = {}
+    for key, path in (("bed", bed), ("chrom_sizes", chrom_sizes)):
+        stat = os.stat(path)
+        source[key] = {
+            "path": os.path.realpath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    return source
+
+
+def read_conversion_source(source_file: Union[str, pathlib.Path]) -> Union[dict, None]:
+    """Read a conversion source record, returning None if it is missing or unreadable"""
+
+    try:
+        with open(source_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def convert_bed_to_bigbed(
+    bed: pathlib.Path,
+    chrom_sizes: Union[str, pathlib.Path],
+    bigbed: pathlib.Path,
+    tmpdir: Union[str, pathlib.Path],
+    sort_threads: int = None,
+    sort_buffer_size: str = "1G",
+) -> pathlib.Path:
+    """Sort a BED file and convert it to bigBed format.
+
+    The conversion is skipped if the bigBed was built from the same BED and chromosome sizes files,
+    as recorded in a <bigbed>.source.json sidecar (resolved path, size and mtime of each input).
+    Sorted intermediates are written to tmpdir and removed once the bigBed is written.
+    When running several conversions at once, lower sort_threads (defaults to all cores) and
+    sort_buffer_size so the GNU sorts share the machine rather than each claiming all of it.
+    """
+
+    # Outputs are named after the BED basename so only skip if this bigBed came from these exact inputs
+    source = get_conversion_source(bed, chrom_sizes)
+    source_file = bigbed.with_name(f"{bigbed.name}.source.json")
+    if bigbed.exists() and read_conversion_source(source_file) == source:
+        logger.debug("{} is up to date, skipping conversion", bigbed.name)
+        return bigbed
+
+    # Drop any stale record so a failed conversion is never treated as up to date
+    source_file.unlink(missing_ok=True)
+
+    logger.debug("Converting {} to BigBed format", bed.name)
+
+    sort_exe = get_tool_path("sort")
+    bed_to_bigbed_exe = get_tool_path("bedToBigBed")
+
+    # Conversions share tmpdir and may run concurrently so each needs its own intermediate file
+    fd, sorted_bed = tempfile.mkstemp(dir=tmpdir, prefix=f"{bigbed.stem}.", suffix=".sorted.bed")
+    os.close(fd)
+    sorted_bed = pathlib.Path(sorted_bed)
+
+    # bedToBigBed expects byte-order (C locale) chromosome sorting
+    sort_env = {**os.environ, "LC_ALL": "C"}
+
+    # Check the sort order in a single streaming pass (stops at the first unsorted line)
+    cmd_check = [sort_exe, "-c", "-k1,1", "-k2,2n", str(bed)]
+    is_sorted = (
+        subprocess.run(cmd_check, env=sort_env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    )
+
+    if is_sorted:
+        sorted_bed.unlink()
+        sorted_bed = bed
+    else:
+        sorted_in_memory = False
+        if bed.stat().st_size <= get_in_memory_sort_max_bytes():
+            with _in_memory_sort_slots:
+                sorted_in_memory = sort_bed_in_memory(bed, sorted_bed)
+
+        if not sorted_in_memory:
+            # Large or non-standard files are sorted with GNU sort, letting sort write the output itself
+            cmd_sort = [
+                sort_exe,
+                f"--parallel={sort_threads or os.cpu_count() or 1}",
+                f"--buffer-size={sort_buffer_size}",
+                "-k1,1",
+                "-k2,2n",
+                str(bed),
+                "-o",
+                str(sorted_bed),
+            ]
+            subprocess.run(cmd_sort, check=True, env=sort_env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    cmd_convert = [
+        bed_to_bigbed_exe,
+        str(sorted_bed),
+        str(chrom_sizes),
+        str(bigbed),
+    ]
+
+    subprocess.run(cmd_convert, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Remove the sorted bed file
+    if not is_sorted:
+        sorted_bed.unlink()
+
+    with open(source_file, "w") as f:
+        json.dump(source, f)
+
+    return bigbed